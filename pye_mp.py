@@ -1,7 +1,7 @@
+PYE_VERSION = " V2.47 "
 import sys, gc
-termcap_vt100 = True
 if sys.platform in ("linux", "darwin"):
-    import os, signal, tty, termios
+    import os, signal, tty, termios, select
     is_linux = True
 else:
     import os
@@ -17,7 +17,19 @@ else:
     const = lambda x:x
     from _io import StringIO
 from re import compile as re_compile
-PYE_VERSION = " V2.47 "
+from time import time, localtime
+try:
+    from time import ticks_ms, ticks_us, ticks_diff
+except ImportError:
+    from time import monotonic
+    ticks_ms = lambda: int(monotonic() * 1000)
+    ticks_diff = lambda a, b: a - b
+    try:
+        from time import perf_counter_ns
+        ticks_us = lambda: divmod(perf_counter_ns(), 1000)[0]
+    except ImportError:
+        ticks_us = lambda: int(monotonic() * 1000000)
+termcap_vt100 = True
 KEY_NONE = const(0x00)
 KEY_UP = const(0x0b)
 KEY_DOWN = const(0x0d)
@@ -68,6 +80,19 @@ KEY_COMMENT = const(0xfffc)
 KEY_MATCH = const(0xfffd)
 KEY_INDENT = const(0xfffe)
 KEY_DEDENT = const(0xffff)
+KEY_BRANCH = const(0xffe9)
+KEY_UNDO_TIME = const(0xffe8)
+KEY_RECORD = const(0xffe7)
+KEY_REPLAY = const(0xffe6)
+KEY_DIFF = const(0xffe5)
+KEY_FOLLOW = const(0xffe4)
+KEY_MEMINFO = const(0xffe3)
+KEY_SPLIT = const(0xffe2)
+KEY_VIEW = const(0xffe1)
+KEY_UNSPLIT = const(0xffe0)
+KEY_NUMBERS = const(0xffdf)
+KEY_OUTLINE = const(0xffde)
+KEY_COMPLETE = const(0xffdd)
 class Editor:
     KEYMAP = {
     "\x1b[A" : KEY_UP,
@@ -128,6 +153,17 @@ class Editor:
     "\x1b[3;5~": KEY_DEL_WORD,
     "\x0b" : KEY_MATCH,
     "\x1b[M" : KEY_MOUSE,
+    "\x1bOQ" : KEY_OUTLINE,
+    "\x1bOR" : KEY_RECORD,
+    "\x1bOS" : KEY_REPLAY,
+    "\x1b[18~": KEY_BRANCH,
+    "\x1b[19~": KEY_UNDO_TIME,
+    "\x1b[15~": KEY_FOLLOW,
+    "\x1b[17~": KEY_SPLIT,
+    "\x1b[17;2~": KEY_UNSPLIT,
+    "\x1b[20~": KEY_VIEW,
+    "\x1b[21~": KEY_NUMBERS,
+    "\x1b[24~": KEY_COMPLETE,
     }
     if termcap_vt100:
         TERMCAP = [
@@ -150,13 +186,30 @@ class Editor:
             "{chd}{file} {row}:{col}  {msg}",
         ]
         def get_screen_size(self):
+            if is_linux and hasattr(os, "get_terminal_size"):
+                try:
+                    size = os.get_terminal_size(Editor.sdev)
+                    return [size.lines, size.columns]
+                except OSError:
+                    pass
             self.wr(Editor.TERMCAP[13])
-            pos = ''
-            char = self.rd()
-            while char != 'R':
-                pos += char
-                char = self.rd()
-            return [int(i, 10) for i in pos.lstrip("\n\x1b[").split(';')]
+            res = ''
+            while True:
+                res += self.rd()
+                i = res.rfind("\x1b[")
+                if res[-1] == 'R' and i >= 0:
+                    try:
+                        size = [int(n, 10) for n in res[i + 2:-1].split(';')]
+                        if len(size) == 2:
+                            break
+                    except ValueError:
+                        pass
+            if i > 0:
+                if is_linux:
+                    Editor.inbuf, Editor.inpos = res[:i].encode() + Editor.inbuf[Editor.inpos:], 0
+                else:
+                    Editor.inbuf = res[:i] + Editor.inbuf
+            return size
     yank_buffer = []
     find_pattern = ""
     case = "n"
@@ -164,6 +217,34 @@ class Editor:
     replc_pattern = ""
     comment_char = "\x23 "
     word_char = "_\\"
+    undo_log = False
+    macro = []
+    recording = False
+    playback = None
+    inbuf = b"" if is_linux else ""
+    inpos = 0
+    fetch = None
+    idle_time = 1000
+    follow_lines = 1000
+    compact = False
+    ram_budget = 0
+    profile = None
+    trace = None
+    resized = True
+    redrawn = False
+    screen = False
+    activations = 0
+    slot_budget = 0
+    scrolling = 0
+    frame_time = 0
+    frame_at = 0
+    wrap = False
+    numbers = 0
+    gutbuf = []
+    gutter_shown = 0
+    complete = False
+    word_count = {}
+    word_list = []
     def __init__(self, tab_size, undo_limit):
         self.top_line = self.cur_line = self.row = self.vcol = self.col = self.margin = 0
         self.tab_size = tab_size
@@ -173,17 +254,45 @@ class Editor:
         self.content = [""]
         self.undo = []
         self.undo_limit = undo_limit
+        self.undo_pos = None
+        self.undo_time = 0
+        self.undo_seq = 0
         self.redo = []
+        self.branches = {}
         self.mark = None
+        self.fstat = None
+        self.fend = None
+        self.tail = None
+        self.follow = False
+        self.lazy = False
+        self.top_row, self.height = 0, 0
+        self.views = []
+        self.cur_view = 0
+        self.top_sub = 0
+        self.wrapped = None
+        self.outline = None
+        self.words = None
+        self.completion = None
+        self.gutter = self.gutter_lines = 0
+        self.columns = 0
+        self.touched = None
+        self.activated = 0
         self.write_tabs = "n"
         self.work_dir = os.getcwd()
     if is_micropython and not is_linux:
         def wr(self, s):
             sys.stdout.write(s)
         def rd(self):
+            if Editor.inbuf:
+                c, Editor.inbuf = Editor.inbuf[:1], Editor.inbuf[1:]
+                return c
             return sys.stdin.read(1)
         def rd_raw(self):
+            if Editor.inbuf:
+                return self.rd()
             return Editor.rd_raw_fct(1)
+        def wait_input(self, ms):
+            return bool(Editor.inbuf or Editor.poller is None or Editor.poller.poll(ms))
         @staticmethod
         def init_tty(device):
             try:
@@ -195,6 +304,13 @@ class Editor:
                 Editor.rd_raw_fct = sys.stdin.buffer.read
             else:
                 Editor.rd_raw_fct = sys.stdin.read
+            try:
+                from select import poll, POLLIN
+                Editor.poller = poll()
+                Editor.poller.register(sys.stdin, POLLIN)
+            except:
+                Editor.poller = None
+                Editor.frame_time = 0
         @staticmethod
         def deinit_tty():
             try:
@@ -220,33 +336,69 @@ class Editor:
     def scroll_region(self, stop):
         self.wr(Editor.TERMCAP[11].format(stop=stop) if stop else Editor.TERMCAP[12])
     def scroll_up(self, scrolling):
-        Editor.scrbuf[scrolling:] = Editor.scrbuf[:-scrolling]
-        Editor.scrbuf[:scrolling] = [''] * scrolling
-        self.goto(0, 0)
-        self.wr(Editor.TERMCAP[9] * scrolling)
+        Editor.scrolling -= scrolling
     def scroll_down(self, scrolling):
-        Editor.scrbuf[:-scrolling] = Editor.scrbuf[scrolling:]
-        Editor.scrbuf[-scrolling:] = [''] * scrolling
-        self.goto(Editor.height - 1, 0)
-        self.wr(Editor.TERMCAP[10] * scrolling)
+        Editor.scrolling += scrolling
+    def scroll_screen(self):
+        scrolling, Editor.scrolling = Editor.scrolling, 0
+        if self.views:
+            return
+        if self.wrap:
+            w = self.wrapped
+            scrolling, w.shown = 0 if w.shown is None else w.top - w.shown, w.top
+        if 0 < -scrolling < Editor.height:
+            scrolling = -scrolling
+            Editor.scrbuf[scrolling:] = Editor.scrbuf[:-scrolling]
+            Editor.scrbuf[:scrolling] = [''] * scrolling
+            Editor.gutbuf[scrolling:] = Editor.gutbuf[:-scrolling]
+            Editor.gutbuf[:scrolling] = [None] * scrolling
+            self.goto(0, 0)
+            self.wr(Editor.TERMCAP[9] * scrolling)
+        elif 0 < scrolling < Editor.height:
+            Editor.scrbuf[:-scrolling] = Editor.scrbuf[scrolling:]
+            Editor.scrbuf[-scrolling:] = [''] * scrolling
+            Editor.gutbuf[:-scrolling] = Editor.gutbuf[scrolling:]
+            Editor.gutbuf[-scrolling:] = [None] * scrolling
+            self.goto(Editor.height - 1, 0)
+            self.wr(Editor.TERMCAP[10] * scrolling)
     def redraw(self, flag):
         self.cursor(False)
-        Editor.height, Editor.width = self.get_screen_size()
-        Editor.height -= 1
+        if Editor.resized:
+            Editor.height, Editor.width = self.get_screen_size()
+            Editor.height -= 1
+            Editor.resized = False
         Editor.scrbuf = [(False,"\x00")] * Editor.height
-        self.row = min(Editor.height - 1, self.row)
+        Editor.gutbuf = [None] * Editor.height
         self.scroll_region(Editor.height)
         self.mouse_reporting(True)
+        if is_linux and not is_micropython and Editor.fetch is None:
+            signal.signal(signal.SIGWINCH, Editor.signal_handler)
+        Editor.screen = True
+        self.activate(flag)
+    def activate(self, flag):
+        Editor.scrolling = 0
+        self.top_row, self.height = self.region(self.cur_view)
+        self.row = min(self.height - 1, self.row)
+        self.touched = 0
+        if self.wrapped:
+            self.wrapped.shown = None
         if flag:
             self.message = PYE_VERSION
-        if is_linux and not is_micropython:
-            signal.signal(signal.SIGWINCH, Editor.signal_handler)
         if is_micropython:
             gc.collect()
             if flag:
                 self.message += "{} Bytes Memory available".format(gc.mem_free())
+        if flag and isinstance(self.content, PackedLines):
+            self.message += ", " + self.content.info()
         self.changed = '' if self.hash == self.hash_buffer() else '*'
     def get_input(self):
+        if Editor.playback is not None:
+            return next(Editor.playback)
+        key = self.get_key()
+        if Editor.recording:
+            Editor.macro.append(key)
+        return key
+    def get_key(self):
         while True:
             in_buffer = self.rd()
             if in_buffer == '\x1b':
@@ -273,76 +425,247 @@ class Editor:
                         return KEY_MOUSE, [mouse_x, mouse_y, mouse_fct]
             elif ord(in_buffer[0]) >= 32:
                 return KEY_NONE, in_buffer
-    def display_window(self):
+    def display_window(self, defer=False):
         self.cur_line = min(self.total_lines - 1, max(self.cur_line, 0))
         self.vcol = max(0, min(self.col, len(self.content[self.cur_line])))
-        if self.vcol >= Editor.width + self.margin:
-            self.margin = self.vcol - Editor.width + (Editor.width >> 2)
-        elif self.vcol < self.margin:
-            self.margin = max(self.vcol - (Editor.width >> 2), 0)
-        if not (self.top_line <= self.cur_line < self.top_line + Editor.height):
-            self.top_line = max(self.cur_line - self.row, 0)
-        self.row = self.cur_line - self.top_line
+        self.set_gutter()
+        if self.wrap:
+            self.align_rows()
+        else:
+            col = col_of(self.content[self.cur_line], self.vcol)
+            if col >= self.columns + self.margin:
+                self.margin = col - self.columns + (self.columns >> 2)
+            elif col < self.margin:
+                self.margin = max(col - (self.columns >> 2), 0)
+            if not (self.top_line <= self.cur_line < self.top_line + self.height):
+                self.top_line = max(self.cur_line - self.row, 0)
+            self.row = self.cur_line - self.top_line
+        if defer or Editor.playback is not None or Editor.inbuf:
+            return
+        if Editor.complete:
+            self.index_words()
         self.cursor(False)
+        if self.gutter != Editor.gutter_shown:
+            Editor.scrbuf = [(False,"\x00")] * Editor.height
+            Editor.gutbuf = [None] * Editor.height
+            Editor.gutter_shown = self.gutter
+            self.touched = 0
+        self.scroll_screen()
+        if self.views:
+            self.paint_views()
+        self.paint_rows()
+        self.goto(Editor.height, 0)
+        self.hilite(1)
+        self.wr(Editor.TERMCAP[15 if Editor.width > 40 else 16].format(
+            chd=self.changed, file=self.fname, row=self.cur_line + 1, total=self.total_lines,
+            col=self.vcol + 1, msg=self.message)[:self.width - 1])
+        self.clear_to_eol()
+        self.hilite(0)
+        self.goto(self.top_row + self.row, col_of(self.content[self.cur_line], self.vcol) +
+            self.gutter - (self.wrapped.start if self.wrap else self.margin))
+        self.cursor(True)
+        Editor.frame_at = ticks_ms()
+    def paint_rows(self):
         line = self.top_line
+        wrapped = self.wrapped if self.wrap else None
+        sub = self.top_sub if wrapped else 0
         if self.mark is None:
             flag = 0
         else:
             start_line, start_col, end_line, end_col = self.mark_range()
-            start_col = max(start_col - self.margin, 0)
-            end_col = max(end_col - self.margin, 0)
-        for c in range(Editor.height):
+        for c in range(self.top_row, self.top_row + self.height):
             if line == self.total_lines:
-                if Editor.scrbuf[c] != (False,''):
+                if Editor.scrbuf[c] != (False,'') or Editor.gutbuf[c]:
                     self.goto(c, 0)
                     self.clear_to_eol()
                     Editor.scrbuf[c] = (False,'')
+                    Editor.gutbuf[c] = ''
             else:
+                text = self.content[line]
+                if wrapped:
+                    points = wrapped.points[line]
+                    sub = min(sub, len(points) - 1)
+                    start = points[sub]
+                    sub += 1
+                    last = sub == len(points)
+                    stop = len(text) if last else points[sub]
+                    pad = 0
+                else:
+                    start = index_of(text, self.margin)
+                    stop = min(index_of(text, self.margin + self.columns, True), len(text))
+                    last = True
+                    pad = col_of(text, start) - self.margin
+                if self.gutter:
+                    num = str(line + 1 if Editor.numbers == 1 or line == self.cur_line else abs(line - self.cur_line))
+                    num = " " * (self.gutter - 1 - len(num)) + num + " " if start == 0 or not wrapped else " " * self.gutter
+                    if num != Editor.gutbuf[c]:
+                        self.goto(c, 0)
+                        self.wr(num)
+                        Editor.gutbuf[c] = num
                 if self.mark is not None:
                     flag = ((start_line <= line < end_line) +
                             ((start_line == line) << 1) +
                             (((end_line - 1) == line) << 2))
-                l = (flag,
-                     self.content[line][self.margin:self.margin + Editor.width])
+                    mark_start = max(start_col - start, 0) + pad
+                    mark_end = max(end_col - start, 0) + pad
+                l = (flag, " " * pad + text[start:stop])
                 if (flag and line == self.cur_line) or l != Editor.scrbuf[c]:
-                    self.goto(c, 0)
+                    self.goto(c, self.gutter)
                     if flag == 0:
                         self.wr(l[1])
                     elif flag == 7:
-                        self.wr(l[1][:start_col])
+                        self.wr(l[1][:mark_start])
                         self.hilite(2)
-                        self.wr(l[1][start_col:end_col])
+                        self.wr(l[1][mark_start:mark_end])
                         self.hilite(0)
-                        self.wr(l[1][end_col:])
+                        self.wr(l[1][mark_end:])
                     elif flag == 3:
-                        self.wr(l[1][:start_col])
+                        self.wr(l[1][:mark_start])
                         self.hilite(2)
-                        self.wr(l[1][start_col:])
-                        self.wr(' ')
+                        self.wr(l[1][mark_start:])
+                        if last:
+                            self.wr(' ')
                         self.hilite(0)
                     elif flag == 5:
                         self.hilite(2)
-                        self.wr(l[1][:end_col])
+                        self.wr(l[1][:mark_end])
                         self.hilite(0)
-                        self.wr(l[1][end_col:])
+                        self.wr(l[1][mark_end:])
                     else:
                         self.hilite(2)
                         self.wr(l[1])
-                        self.wr(' ')
+                        if last:
+                            self.wr(' ')
                         self.hilite(0)
-                    if len(l[1]) < Editor.width:
+                    if col_of(text, stop) - col_of(text, start) + pad < self.columns:
                         self.clear_to_eol()
                     Editor.scrbuf[c] = l
-                line += 1
-        self.goto(Editor.height, 0)
-        self.hilite(1)
-        self.wr(Editor.TERMCAP[15 if Editor.width > 40 else 16].format(
-            chd=self.changed, file=self.fname, row=self.cur_line + 1, total=self.total_lines,
-            col=self.vcol + 1, msg=self.message)[:self.width - 1])
-        self.clear_to_eol()
-        self.hilite(0)
-        self.goto(self.row, self.vcol - self.margin)
-        self.cursor(True)
+                if last:
+                    line += 1
+                    sub = 0
+    def align_rows(self):
+        w = self.wrapped
+        if w is None or w.width != self.columns:
+            w = self.wrapped = Wrap(self.columns)
+        w.update(self.content)
+        self.top_line = min(self.top_line, self.total_lines - 1)
+        top = w.rows(self.top_line) + min(self.top_sub, len(w.points[self.top_line]) - 1)
+        sub = w.sub(self.cur_line, self.vcol)
+        cur = w.rows(self.cur_line) + sub
+        if not (top <= cur < top + self.height):
+            top = max(cur - self.row, 0)
+        self.top_line, self.top_sub = w.find(top)
+        self.row = cur - top
+        w.top, w.start = top, col_of(self.content[self.cur_line], w.points[self.cur_line][sub])
+    def move_rows(self, n, x=None):
+        w, l = self.wrapped, self.content[self.cur_line]
+        sub = w.sub(self.cur_line, self.vcol)
+        if x is None:
+            x = col_of(l, self.vcol) - col_of(l, w.points[self.cur_line][sub])
+        self.cur_line, sub = w.find(max(w.rows(self.cur_line) + sub + n, 0))
+        l, points = self.content[self.cur_line], w.points[self.cur_line]
+        self.col = index_of(l, col_of(l, points[sub]) + x)
+        if sub + 1 < len(points):
+            self.col = min(self.col, points[sub + 1] - 1)
+    def scroll_rows(self, n):
+        w = self.wrapped
+        top = max(min(w.top + n, w.rows(self.total_lines) - self.height), 0)
+        self.top_line, self.top_sub = w.find(top)
+        cur = w.rows(self.cur_line) + w.sub(self.cur_line, self.vcol)
+        if cur < top:
+            self.move_rows(top - cur)
+        elif cur >= top + self.height:
+            self.move_rows(top + self.height - 1 - cur)
+    def set_gutter(self):
+        if not Editor.numbers:
+            self.gutter = 0
+        elif self.gutter == 0 or not (self.gutter_lines <= self.total_lines < self.gutter_lines * 10):
+            digits = len(str(self.total_lines))
+            self.gutter, self.gutter_lines = digits + 1, 10 ** (digits - 1)
+        self.columns = Editor.width - self.gutter
+    def region(self, i):
+        n = len(self.views) or 1
+        rows = int((Editor.height - n + 1) / n)
+        top_row = i * (rows + 1)
+        return top_row, rows if i < n - 1 else Editor.height - top_row
+    def view_state(self):
+        return [self.top_line, self.cur_line, self.row, self.col, self.margin, self.mark, self.top_sub]
+    def switch_view(self, i):
+        self.views[self.cur_view] = self.view_state()
+        self.touched = self.top_line if self.touched is None else min(self.touched, self.top_line)
+        self.load_view(i)
+    def load_view(self, i):
+        self.cur_view = i
+        self.top_line, self.cur_line, self.row, self.col, self.margin, self.mark, self.top_sub = self.views[i]
+        self.clamp_view()
+        self.top_row, self.height = self.region(i)
+        self.row = min(self.height - 1, self.row)
+    def clamp_view(self):
+        self.cur_line = min(self.cur_line, self.total_lines - 1)
+        self.top_line = min(self.top_line, self.cur_line)
+        if self.mark is not None and self.mark[0] >= self.total_lines:
+            self.mark = (self.total_lines - 1, len(self.content[self.total_lines - 1]))
+    def view_at(self, row):
+        for i in range(len(self.views)):
+            top_row, rows = self.region(i)
+            if top_row <= row < top_row + rows:
+                return i
+        return self.cur_view
+    def touch(self, line, end=None):
+        self.touched = line if self.touched is None else min(self.touched, line)
+        for index in (self.wrapped, self.outline, self.words):
+            if index is not None:
+                index.touch(self.content, line, end)
+    def unindex(self, lost=False):
+        if lost:
+            Editor.word_count, Editor.word_list = {}, []
+            Words.epoch += 1
+        elif self.words is not None:
+            self.words.update([])
+    def paint_views(self):
+        if self.touched is not None:
+            state, region = self.view_state(), (self.top_row, self.height)
+            for i, v in enumerate(self.views):
+                self.top_row, self.height = self.region(i)
+                if i != self.cur_view and self.touched < v[0] + self.height:
+                    self.top_line, self.cur_line, self.row, self.col, self.margin, self.mark, self.top_sub = v
+                    self.clamp_view()
+                    self.paint_rows()
+                    self.views[i] = self.view_state()
+            self.top_line, self.cur_line, self.row, self.col, self.margin, self.mark, self.top_sub = state
+            self.top_row, self.height = region
+            self.touched = None
+        for i in range(len(self.views) - 1):
+            top_row, rows = self.region(i)
+            l = (None, " {} {}/{}".format(self.fname, i + 1, len(self.views))[:Editor.width])
+            if Editor.scrbuf[top_row + rows] != l:
+                self.goto(top_row + rows, 0)
+                self.hilite(1)
+                self.wr(l[1])
+                self.clear_to_eol()
+                self.hilite(0)
+                Editor.scrbuf[top_row + rows] = l
+                Editor.gutbuf[top_row + rows] = None
+    def split(self):
+        if Editor.height - len(self.views) < 2 * (len(self.views) + 2):
+            self.message = "No room for another view"
+            return
+        if not self.views:
+            self.views = [self.view_state()]
+        self.views.insert(self.cur_view + 1, self.view_state())
+        self.switch_view(self.cur_view + 1)
+        self.touched = 0
+    def unsplit(self):
+        del self.views[self.cur_view]
+        self.load_view(min(self.cur_view, len(self.views) - 1))
+        if len(self.views) == 1:
+            self.views, self.cur_view = [], 0
+            self.top_row, self.height = self.region(0)
+            self.row = min(self.height - 1, self.cur_line - self.top_line)
+        self.touched = 0
+    def frame_pending(self):
+        ms = Editor.frame_time - ticks_diff(ticks_ms(), Editor.frame_at)
+        return ms > 0 and self.wait_input(ms)
     def spaces(self, line, pos = None):
         return (len(line) - len(line.lstrip(" ")) if pos is None else
                 len(line[:pos]) - len(line[:pos].rstrip(" ")))
@@ -357,7 +680,7 @@ class Editor:
                     (self.cur_line, self.col, self.mark[0] + 1, self.mark[1]))
     def line_range(self):
         res = self.mark_range()
-        return (res[0], res[2]) if res[3] > 0 else (res[0], res[2] - 1)
+        return (res[0], res[2]) if res[3] > 0 else (res[0], max(res[2] - 1, res[0] + 1))
     def line_edit(self, prompt, default, zap=None):
         push_msg = lambda msg: self.wr(msg + Editor.TERMCAP[14] * len(msg))
         self.goto(Editor.height, 0)
@@ -410,6 +733,71 @@ class Editor:
                 res = self.getsymbol(self.content[self.cur_line], self.col, zap)
                 self.wr(res)
                 pos = len(res)
+    def index_words(self):
+        if self.words is None:
+            self.words = Words()
+        self.words.update(self.content)
+    def complete_word(self, l):
+        c = self.completion
+        if c is not None and c[0:2] == [self.cur_line, self.vcol] and l[c[2]:self.vcol] == c[3][c[4]]:
+            c[4] = (c[4] + 1) % len(c[3])
+        else:
+            Editor.complete = True
+            self.index_words()
+            start = self.skip_while(l, self.vcol - 1, self.word_char, -1) + 1
+            prefix, words = l[start:self.vcol], Editor.word_list
+            found, i = [], lower_bound(words, prefix)
+            while i < len(words) and words[i].startswith(prefix):
+                if words[i] != prefix:
+                    found.append(words[i])
+                i += 1
+            if not prefix or not found:
+                self.message = "No completion"
+                return
+            found.sort(key=lambda w: -Editor.word_count[w])
+            c = [self.cur_line, self.vcol, start, [prefix] + found, 1]
+        word = c[3][c[4]]
+        self.undo_add(self.cur_line, [l], KEY_NONE)
+        self.content[self.cur_line] = l[:c[2]] + word + l[self.vcol:]
+        self.col = c[1] = c[2] + len(word)
+        self.completion = c
+    def pick(self, prompt, items):
+        res, sel, painted = "", 0, 0
+        while True:
+            shown = [i for i in items if res in i[0]] if Editor.case == "y" else [
+                i for i in items if res.lower() in i[0].lower()]
+            sel = max(min(sel, len(shown) - 1), 0)
+            rows = min(len(shown), Editor.height)
+            first = max(sel - rows + 1, 0)
+            for r in range(max(rows, painted)):
+                self.goto(r, 0)
+                if r < rows:
+                    self.hilite(2 if first + r == sel else 0)
+                    self.wr(shown[first + r][0][:Editor.width])
+                    self.hilite(0)
+                self.clear_to_eol()
+                Editor.scrbuf[r], Editor.gutbuf[r] = (False, "\x00"), None
+            painted = rows
+            self.touched = 0
+            self.goto(Editor.height, 0)
+            self.hilite(1)
+            self.wr((prompt + res)[:Editor.width - 1])
+            self.clear_to_eol()
+            self.hilite(0)
+            key, char = self.get_input()
+            if key == KEY_NONE:
+                res += char
+                sel = 0
+            elif key == KEY_BACKSPACE:
+                res = res[:-1]
+            elif key == KEY_UP:
+                sel -= 1
+            elif key == KEY_DOWN:
+                sel += 1
+            elif key in (KEY_ENTER, KEY_TAB):
+                return shown[sel][1] if shown else None
+            elif key in (KEY_QUIT, KEY_COPY):
+                return None
     def getsymbol(self, s, pos, zap):
         if pos < len(s) and zap is not None:
             start = self.skip_while(s, pos, zap, -1)
@@ -443,12 +831,12 @@ class Editor:
             return False
     def move_left(self):
         self.col = self.vcol
-        if not self.skip_up():
+        if not self.skip_up() and self.col > 0:
             self.col -= 1
     def move_down(self):
         if self.cur_line < self.total_lines - 1:
             self.cur_line += 1
-            if self.cur_line == self.top_line + Editor.height:
+            if self.cur_line == self.top_line + self.height:
                 self.scroll_down(1)
     def skip_down(self, l):
         if self.col >= len(l) and self.cur_line < self.total_lines - 1:
@@ -491,23 +879,68 @@ class Editor:
             return None
     def undo_add(self, lnum, text, key, span = 1, chain=False):
         self.changed = '*'
+        self.touch(lnum, None if text is None else lnum + (1 if type(text) is str else len(text)))
         if (len(self.undo) == 0 or key == KEY_NONE or
-            self.undo[-1][3] != key or self.undo[-1][0] != lnum):
-            if len(self.undo) >= self.undo_limit:
-                del self.undo[0]
-            self.undo.append([lnum, span, text, key, self.col, chain])
-            self.redo = []
+            self.undo[-1][3] != key or self.undo[-1][0] != lnum or self.undo[-1][1] != span):
+            if self.redo:
+                self.branches.setdefault(self.undo[-1][6] if self.undo else 0, []).append(self.redo)
+                self.redo = []
+            self.undo_drop(len(self.undo) - self.undo_limit + 1)
+            self.undo_seq += 1
+            self.undo.append([lnum, span, text, key, self.col, chain, self.undo_seq, time()])
+    def undo_drop(self, n):
+        if n > 0:
+            self.branches.pop(0, None)
+            for action in self.undo[:n]:
+                self.branches.pop(action[6], None)
+            del self.undo[:n]
+            self.undo_pos = 0
+    def undo_type(self, text, chain):
+        now = ticks_ms()
+        if self.undo and not chain:
+            action = self.undo[-1]
+            if (type(action[2]) is str and action[1] < 0 and
+                ticks_diff(now, self.undo_time) < 1000 and
+                not (self.issymbol(text[0], self.word_char) and
+                     not self.issymbol(action[2][-1], self.word_char))):
+                i = action[2].rfind("\n")
+                if (self.cur_line == action[0] + action[2].count("\n") and
+                    self.col == (action[4] + len(action[2]) if i < 0 else len(action[2]) - i - 1)):
+                    action[2] += text
+                    self.undo_time = now
+                    self.touch(self.cur_line, self.cur_line + 1)
+                    self.changed = '*'
+                    return
+        self.undo_add(self.cur_line, text, KEY_NONE, -1, chain)
+        self.undo_time = now
     def undo_redo(self, undo, redo):
         chain = True
         redo_start = len(redo)
         while len(undo) > 0 and chain:
             action = undo.pop()
+            if type(action[2]) is str:
+                self.touch(action[0], action[0] + (action[2].count("\n") + 1 if action[1] < 0 else 1))
+            else:
+                self.touch(action[0], action[0] + abs(action[1]))
             if not action[3] in (KEY_INDENT, KEY_DEDENT, KEY_COMMENT):
                 self.cur_line = action[0]
             self.col = action[4]
-            if len(redo) >= self.undo_limit:
+            if len(redo) >= self.undo_limit and redo_start > 0:
                 del redo[0]
-            if action[1] >= 0:
+                redo_start -= 1
+            if type(action[2]) is str:
+                redo.append(action[0:1] + [-1 - action[1]] + action[2:])
+                lines = action[2].split("\n")
+                l = self.content[action[0]]
+                if action[1] < 0:
+                    end = action[0] + len(lines) - 1
+                    tail = self.content[end][len(lines[-1]) + (action[4] if end == action[0] else 0):]
+                    self.content[action[0]:end + 1] = [l[:action[4]] + tail]
+                else:
+                    lines[0] = l[:action[4]] + lines[0]
+                    lines[-1] += l[action[4]:]
+                    self.content[action[0]:action[0] + 1] = lines
+            elif action[1] >= 0:
                 if action[1] == 0:
                     redo.append(action[0:1] + [-len(action[2]), None] + action[3:])
                 else:
@@ -528,6 +961,125 @@ class Editor:
             self.total_lines = len(self.content)
             self.changed = '' if self.hash == self.hash_buffer() else '*'
             self.mark = None
+    def undo_branch(self):
+        anchor = self.undo[-1][6] if self.undo else 0
+        alt = self.branches.get(anchor)
+        if alt:
+            if self.redo:
+                alt.append(self.redo)
+            self.redo = alt.pop(0)
+            if not alt:
+                del self.branches[anchor]
+        return len(alt) if alt else 0
+    def undo_jump(self, t):
+        while self.undo and self.undo[-1][7] > t:
+            self.undo_redo(self.undo, self.redo)
+        while self.redo and self.redo[-1][7] <= t:
+            self.undo_redo(self.redo, self.undo)
+    def undo_save(self, fname):
+        logname = fname + ".pyeundo"
+        keep = self.undo_pos if fname == self.fname else 0
+        start = self.undo_cut(logname, keep, self.undo_limit - len(self.undo)) if keep else 0
+        with open(logname + ".pyetmp", "wb") as f:
+            if keep > start:
+                with open(logname, "rb") as g:
+                    g.seek(start)
+                    while keep - start > f.tell():
+                        f.write(g.read(min(keep - start - f.tell(), 512)))
+            for action in self.undo:
+                text = action[2].split("\n") if type(action[2]) is str else action[2]
+                for l in text or ():
+                    f.write(l.encode("utf-8") + b"\n")
+                f.write("{} {} {} {} {} {} {} {}\n".format("S" if text is not action[2] else "L",
+                    action[0], action[1], action[3], action[4], int(action[5]),
+                    -1 if text is None else len(text), int(action[7])).encode())
+            f.write("H {} {} {}\n".format(self.crc_buffer(), *self.fstat).encode())
+        try:
+            os.remove(logname)
+        except:
+            pass
+        os.rename(logname + ".pyetmp", logname)
+        self.undo_pos = keep - start
+    def undo_cut(self, logname, pos, n):
+        try:
+            with open(logname, "rb") as f:
+                lines = lines_back(f, pos)
+                for l, start in lines:
+                    if n <= 0:
+                        return pos
+                    h = l.split()
+                    if h[0] in (b"L", b"S"):
+                        for i in range(int(h[6])):
+                            l, start = next(lines)
+                        n -= 1
+                        pos = start
+        except (OSError, ValueError, IndexError, StopIteration):
+            pass
+        return pos if n <= 0 else 0
+    def undo_probe(self, logname, crc):
+        try:
+            with open(logname, "rb") as f:
+                for l, pos in lines_back(f, f.seek(0, 2)):
+                    h = l.split()
+                    if (h[0] == b"H" and (int(h[2]), int(h[3])) == self.fstat and
+                        (crc is None or int(h[1]) == crc)):
+                        return pos
+                    break
+        except (OSError, ValueError, IndexError):
+            pass
+        return 0
+    def undo_load(self):
+        logname = self.fname + ".pyeundo"
+        if self.undo_pos is None:
+            self.undo_pos = self.undo_probe(logname, self.crc_buffer())
+        if self.undo_pos:
+            with open(logname, "rb") as f:
+                lines = lines_back(f, self.undo_pos)
+                for l, pos in lines:
+                    h = l.split()
+                    if h[0] in (b"L", b"S"):
+                        n = int(h[6])
+                        text = [] if n >= 0 else None
+                        for i in range(n):
+                            l, pos = next(lines)
+                            text.insert(0, l.decode("utf-8"))
+                        if h[0] == b"S":
+                            text = "\n".join(text)
+                        self.undo_seq += 1
+                        if not self.undo and 0 in self.branches:
+                            self.branches[self.undo_seq] = self.branches.pop(0)
+                        self.undo.insert(0, [int(h[1]), int(h[2]), text, int(h[3]), int(h[4]),
+                                             h[5] == b"1", self.undo_seq, int(h[7])])
+                        self.undo_pos = pos
+                        if len(self.undo) >= self.undo_limit >> 1:
+                            return
+            self.undo_pos = 0
+    def replay(self, count, lrange):
+        seq, limit, lines = self.undo_seq, self.undo_limit, self.total_lines
+        self.undo_limit = 1 << 30
+        try:
+            for i in range(count if lrange is None else lrange[1] - lrange[0]):
+                if lrange is not None:
+                    self.cur_line, self.col = lrange[0] + i + self.total_lines - lines, 0
+                Editor.playback = iter(Editor.macro)
+                try:
+                    while True:
+                        self.display_window()
+                        key, char = self.get_input()
+                        if key not in (KEY_REPLAY, KEY_REDRAW):
+                            self.handle_edit_keys(key, char)
+                except StopIteration:
+                    pass
+        finally:
+            Editor.playback = None
+            self.undo_limit = limit
+            ni = 0
+            while ni < len(self.undo) and self.undo[-1 - ni][6] > seq:
+                self.undo[-1 - ni][5] = True
+                ni += 1
+            if ni:
+                self.undo[-ni][5] = False
+            self.undo_drop(min(len(self.undo) - limit, len(self.undo) - ni))
     def set_mark(self):
         if self.mark is None:
             self.mark = (self.cur_line, self.col)
@@ -540,6 +1092,7 @@ class Editor:
         if yank:
             self.yank_mark()
         start_row, start_col, end_row, end_col = self.mark_range()
+        start_col = min(start_col, len(self.content[start_row]))
         self.undo_add(start_row, self.content[start_row:end_row], KEY_NONE, 1, False)
         self.content[start_row] = self.content[start_row][:start_col] + self.content[end_row - 1][end_col:]
         if start_row + 1 < end_row:
@@ -551,6 +1104,31 @@ class Editor:
         self.total_lines = len(self.content)
         self.cur_line = start_row
         self.mark = None
+    def indent(self, lrange):
+        self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_INDENT, lrange[1] - lrange[0])
+        for i in range(lrange[0],lrange[1]):
+            if len(self.content[i]) > 0:
+                self.content[i] = ' ' * (self.tab_size - self.spaces(self.content[i]) % self.tab_size) + self.content[i]
+    def dedent(self, lrange):
+        self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_DEDENT, lrange[1] - lrange[0])
+        for i in range(lrange[0],lrange[1]):
+            ns = self.spaces(self.content[i])
+            if ns > 0:
+                self.content[i] = self.content[i][(ns - 1) % self.tab_size + 1:]
+    def comment(self, lrange):
+        self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_COMMENT, lrange[1] - lrange[0])
+        ni = len(Editor.comment_char)
+        for i in range(lrange[0],lrange[1]):
+            if self.content[i].strip() != "":
+                ns = self.spaces(self.content[i])
+                if self.content[i][ns:ns + ni] == Editor.comment_char:
+                    self.content[i] = ns * " " + self.content[i][ns + ni:]
+                else:
+                    self.content[i] = ns * " " + Editor.comment_char + self.content[i][ns:]
+    def replace_match(self, ni, rpat, chain):
+        self.undo_add(self.cur_line, [self.content[self.cur_line]], KEY_NONE, 1, chain)
+        self.content[self.cur_line] = self.content[self.cur_line][:self.col] + rpat + self.content[self.cur_line][self.col + ni:]
+        self.col += len(rpat) + (ni == 0)
     def handle_edit_keys(self, key, char):
         l = self.content[self.cur_line]
         if key == KEY_NONE:
@@ -561,7 +1139,7 @@ class Editor:
                 chain = True
             else:
                 chain = False
-            self.undo_add(self.cur_line, [l], 0x20 if char == " " else 0x41, 1, chain)
+            self.undo_type(char, chain)
             self.content[self.cur_line] = l[:self.col] + char + l[self.col:]
             self.col += len(char)
         elif key == KEY_SHIFT_CTRL_LEFT:
@@ -571,9 +1149,15 @@ class Editor:
             self.set_mark()
             key = KEY_WORD_RIGHT
         if key == KEY_DOWN:
-             self.move_down()
+            if self.wrap:
+                self.move_rows(1)
+            else:
+                self.move_down()
         elif key == KEY_UP:
-            self.move_up()
+            if self.wrap:
+                self.move_rows(-1)
+            else:
+                self.move_up()
         elif key == KEY_LEFT:
             self.move_left()
         elif key == KEY_RIGHT:
@@ -631,32 +1215,39 @@ class Editor:
             ns = self.spaces(l)
             self.col = ni if self.col >= len(l) and ni > ns else len(l)
         elif key == KEY_PGUP:
-            self.cur_line -= Editor.height
+            if self.wrap:
+                self.move_rows(-self.height)
+            else:
+                self.cur_line -= self.height
         elif key == KEY_PGDN:
-            self.cur_line += Editor.height
+            if self.wrap:
+                self.move_rows(self.height)
+            else:
+                self.cur_line += self.height
         elif key == KEY_FIND:
             pat = self.line_edit("Find: ", Editor.find_pattern, "_")
             if pat:
                 self.find_in_file(pat, self.col, self.total_lines)
-                self.row = Editor.height >> 1
+                self.row = self.height >> 1
         elif key == KEY_FIND_AGAIN:
             if Editor.find_pattern:
                 self.find_in_file(Editor.find_pattern, self.col + 1, self.total_lines)
-                self.row = Editor.height >> 1
+                self.row = self.height >> 1
         elif key == KEY_GOTO:
             line = self.line_edit("Goto Line: ", "")
             if line:
                 self.cur_line = int(line) - 1
-                self.row = Editor.height >> 1
+                self.row = self.height >> 1
         elif key == KEY_FIRST:
             self.cur_line = 0
         elif key == KEY_LAST:
             self.cur_line = self.total_lines - 1
-            self.row = Editor.height - 1
+            self.row = self.height - 1
         elif key == KEY_TOGGLE:
             pat = self.line_edit("Autoindent {}, Search Case {}"
-            ", Tabsize {}, Comment {}, Tabwrite {}: ".format(
-            Editor.autoindent, Editor.case, self.tab_size, Editor.comment_char, self.write_tabs), "")
+            ", Tabsize {}, Comment {}, Tabwrite {}, Wrap {}: ".format(
+            Editor.autoindent, Editor.case, self.tab_size, Editor.comment_char, self.write_tabs,
+            'y' if Editor.wrap else 'n'), "")
             try:
                 res = [i.lstrip().lower() for i in pat.split(",")]
                 if res[0]: Editor.autoindent = 'y' if res[0][0] == 'y' else 'n'
@@ -664,23 +1255,33 @@ class Editor:
                 if res[2]: self.tab_size = int(res[2])
                 if res[3]: Editor.comment_char = res[3]
                 if res[4]: self.write_tabs = 'y' if res[4][0] == 'y' else 'n'
+                if res[5]: Editor.wrap = res[5][0] == 'y'
             except:
                 pass
         elif key == KEY_MOUSE:
-            if char[1] < Editor.height:
-                self.col = char[0] + self.margin
-                self.cur_line = char[1] + self.top_line
+            if self.views and char[1] < Editor.height:
+                self.switch_view(self.view_at(char[1]))
+            if self.top_row <= char[1] < self.top_row + self.height:
+                if self.wrap:
+                    self.move_rows(char[1] - self.top_row - self.row, max(char[0] - self.gutter, 0))
+                else:
+                    self.cur_line = min(char[1] - self.top_row + self.top_line, self.total_lines - 1)
+                    self.col = index_of(self.content[self.cur_line], max(char[0] - self.gutter, 0) + self.margin)
                 if char[2] in (0x22, 0x30):
                     self.mark = (self.cur_line, self.col) if self.mark is None else None
         elif key == KEY_SCRLUP:
             ni = 1 if char is None else 3
-            if self.top_line > 0:
+            if self.wrap:
+                self.scroll_rows(-ni)
+            elif self.top_line > 0:
                 self.top_line = max(self.top_line - ni, 0)
-                self.cur_line = min(self.cur_line, self.top_line + Editor.height - 1)
+                self.cur_line = min(self.cur_line, self.top_line + self.height - 1)
                 self.scroll_up(ni)
         elif key == KEY_SCRLDN:
             ni = 1 if char is None else 3
-            if self.top_line + Editor.height < self.total_lines:
+            if self.wrap:
+                self.scroll_rows(ni)
+            elif self.top_line + self.height < self.total_lines:
                 self.top_line = min(self.top_line + ni, self.total_lines - 1)
                 self.cur_line = max(self.cur_line, self.top_line)
                 self.scroll_down(ni)
@@ -762,11 +1363,11 @@ class Editor:
         elif key == KEY_ENTER:
             self.col = self.vcol
             self.mark = None
-            self.undo_add(self.cur_line, [l], KEY_NONE, 2)
-            self.content[self.cur_line] = l[:self.col]
             ni = 0
             if Editor.autoindent == "y":
                 ni = min(self.spaces(l), self.col)
+            self.undo_type("\n" + ' ' * ni, False)
+            self.content[self.cur_line] = l[:self.col]
             self.cur_line += 1
             self.content[self.cur_line:self.cur_line] = [' ' * ni + l[self.col:]]
             self.total_lines += 1
@@ -779,11 +1380,7 @@ class Editor:
                 self.content[self.cur_line] = l[:self.col] + ' ' * ni + l[self.col:]
                 self.col += ni
             else:
-                lrange = self.line_range()
-                self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_INDENT, lrange[1] - lrange[0])
-                for i in range(lrange[0],lrange[1]):
-                    if len(self.content[i]) > 0:
-                        self.content[i] = ' ' * (self.tab_size - self.spaces(self.content[i]) % self.tab_size) + self.content[i]
+                self.indent(self.line_range())
         elif key == KEY_BACKTAB:
             if self.mark is None:
                 self.col = self.vcol
@@ -793,12 +1390,7 @@ class Editor:
                     self.content[self.cur_line] = l[:self.col - ni] + l[self.col:]
                     self.col -= ni
             else:
-                lrange = self.line_range()
-                self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_DEDENT, lrange[1] - lrange[0])
-                for i in range(lrange[0],lrange[1]):
-                    ns = self.spaces(self.content[i])
-                    if ns > 0:
-                        self.content[i] = self.content[i][(ns - 1) % self.tab_size + 1:]
+                self.dedent(self.line_range())
         elif key == KEY_REPLC:
             count = 0
             pat = self.line_edit("Replace: ", Editor.find_pattern, "_")
@@ -825,9 +1417,7 @@ class Editor:
                             if q == 'q' or key == KEY_QUIT:
                                 break
                             elif q in ('a','y'):
-                                self.undo_add(self.cur_line, [self.content[self.cur_line]], KEY_NONE, 1, chain)
-                                self.content[self.cur_line] = self.content[self.cur_line][:self.col] + rpat + self.content[self.cur_line][self.col + ni:]
-                                self.col += len(rpat) + (ni == 0)
+                                self.replace_match(ni, rpat, chain)
                                 count += 1
                                 chain = True
                             else:
@@ -854,70 +1444,350 @@ class Editor:
                 head, tail = Editor.yank_buffer[0], Editor.yank_buffer[-1]
                 Editor.yank_buffer[0] = self.content[self.cur_line][:self.col] + Editor.yank_buffer[0]
                 Editor.yank_buffer[-1] += self.content[self.cur_line][self.col:]
-                if len(Editor.yank_buffer) > 1:
-                    self.undo_add(self.cur_line, None, KEY_NONE, -len(Editor.yank_buffer) + 1, chain)
-                else:
-                    self.undo_add(self.cur_line, [self.content[self.cur_line]], KEY_NONE, 1, chain)
+                self.undo_add(self.cur_line, [self.content[self.cur_line]], KEY_NONE, len(Editor.yank_buffer), chain)
                 self.content[self.cur_line:self.cur_line + 1] = Editor.yank_buffer
                 Editor.yank_buffer[-1], Editor.yank_buffer[0] = tail, head
                 self.total_lines = len(self.content)
         elif key == KEY_WRITE:
             fname = self.line_edit("Save File: ", self.fname, "_.-")
-            if fname:
-                self.put_file(fname)
-                self.fname = fname
-                self.hash = self.hash_buffer()
-                self.changed = ''
+            if fname == self.fname and self.tail is not None:
+                self.message = "Only the end of the file is loaded"
+            elif fname:
+                res = self.check_file() if fname == self.fname else ''
+                if res == 'D':
+                    return KEY_DIFF
+                elif res != 'R':
+                    self.save_file(fname)
         elif key == KEY_UNDO:
+            if not self.undo and Editor.undo_log and self.fname:
+                self.undo_load()
             self.undo_redo(self.undo, self.redo)
+            if (self.undo[-1][6] if self.undo else 0) in self.branches:
+                self.message = "More undo branches (F7)"
         elif key == KEY_REDO:
             self.undo_redo(self.redo, self.undo)
+        elif key == KEY_BRANCH:
+            ni = self.undo_branch()
+            self.message = "Switched branch, {} more".format(ni) if ni else "No other branch"
+        elif key == KEY_UNDO_TIME:
+            pat = self.line_edit("Undo to time hh:mm[:ss]: ", "")
+            if pat:
+                try:
+                    t = [int(i) for i in pat.split(":")] + [0]
+                    lt = localtime()
+                    self.undo_jump(time() - (lt[3] - t[0]) * 3600 - (lt[4] - t[1]) * 60 - lt[5] + t[2])
+                except:
+                    self.message = "Invalid time: " + pat
+        elif key == KEY_COMPLETE:
+            self.complete_word(l)
         elif key == KEY_COMMENT:
             if self.mark is None:
-                lrange = (self.cur_line, self.cur_line + 1)
+                self.comment((self.cur_line, self.cur_line + 1))
             else:
-                lrange = self.line_range()
-            self.undo_add(lrange[0], self.content[lrange[0]:lrange[1]], KEY_COMMENT, lrange[1] - lrange[0])
-            ni = len(Editor.comment_char)
-            for i in range(lrange[0],lrange[1]):
-                if self.content[i].strip() != "":
-                    ns = self.spaces(self.content[i])
-                    if self.content[i][ns:ns + ni] == Editor.comment_char:
-                        self.content[i] = ns * " " + self.content[i][ns + ni:]
-                    else:
-                        self.content[i] = ns * " " + Editor.comment_char + self.content[i][ns:]
+                self.comment(self.line_range())
+        elif key == KEY_RECORD:
+            Editor.recording = not Editor.recording
+            if Editor.recording:
+                Editor.macro = []
+                self.message = "Recording macro (F3 to stop)"
+            else:
+                del Editor.macro[-1:]
+                self.message = "Macro of {} keys recorded".format(len(Editor.macro))
+        elif key == KEY_REPLAY:
+            if Editor.recording:
+                del Editor.macro[-1:]
+            elif Editor.macro:
+                if self.mark is None:
+                    pat = self.line_edit("Replay macro times: ", "")
+                    if pat is not None:
+                        try:
+                            count = int(pat) if pat else 1
+                        except ValueError:
+                            self.message = "Invalid number: " + pat
+                        else:
+                            self.replay(count, None)
+                else:
+                    lrange = self.line_range()
+                    self.mark = None
+                    self.replay(1, lrange)
+        elif key == KEY_FOLLOW:
+            if self.tail is not None:
+                self.follow = not self.follow
+                self.message = "Follow " + ("on" if self.follow else "off")
+                self.check_file()
+            elif self.fstat is None:
+                self.message = "Not a file"
+            elif self.hash != self.hash_buffer():
+                self.message = "Buffer changed, save it first"
+            else:
+                self.follow_start()
+                self.message = "Follow on, F5 to stop"
+        elif key == KEY_SPLIT:
+            self.split()
+        elif key == KEY_UNSPLIT:
+            if self.views:
+                self.unsplit()
+        elif key == KEY_VIEW:
+            if self.views:
+                self.switch_view((self.cur_view + 1) % len(self.views))
+        elif key == KEY_OUTLINE:
+            if self.outline is None:
+                self.outline = Outline()
+            self.outline.update(self.content)
+            line = self.pick("Goto symbol: ", self.outline.symbols())
+            if line is not None:
+                self.cur_line, self.col = line, self.spaces(self.content[line])
+                self.row = self.height >> 1
+        elif key == KEY_NUMBERS:
+            Editor.numbers = (Editor.numbers + 1) % 3
+            self.touched = 0
         elif key == KEY_REDRAW:
+            Editor.resized = True
             self.redraw(True)
-    def edit_loop(self):
+    def edit_start(self):
+        os.chdir(self.work_dir)
+        if self.lazy:
+            self.load()
         if not self.content:
             self.content = [""]
         self.total_lines = len(self.content)
-        os.chdir(self.work_dir)
-        self.redraw(self.message == "")
-        while True:
+        Editor.activations += 1
+        self.activated = Editor.activations
+        if Editor.screen and not Editor.resized:
+            self.activate(self.message == "")
+        else:
+            self.redraw(self.message == "")
+        self.display_window()
+        return KEY_DIFF if self.check_file() == 'D' else None
+    def load(self):
+        self.lazy = False
+        try:
+            if self.follow:
+                self.follow_start()
+            else:
+                self.get_file(self.fname)
+        except Exception as err:
+            self.message = "{!r}".format(err)
+    def unload(self):
+        self.unindex()
+        self.content, self.fstat, self.undo_pos = [""], None, None
+        self.words = None
+        self.lazy = True
+    def idle(self):
+        if is_linux and Editor.winch:
+            Editor.winch = False
+            Editor.resized = True
+            self.redraw(False)
+        return KEY_DIFF if self.check_file() == 'D' else None
+    def edit_key(self, key, char):
+        if key == KEY_REDRAW and Editor.redrawn:
+            Editor.redrawn = False
+            return KEY_MEMINFO
+        Editor.redrawn = key == KEY_REDRAW
+        self.message = ''
+        if key == KEY_QUIT:
+            if self.hash != self.hash_buffer():
+                res = self.line_edit("File changed! Quit (y/N)? ", "N")
+                if not res or res[0].upper() != 'Y':
+                    return None
+            self.scroll_region(0)
+            self.mouse_reporting(False)
+            self.goto(Editor.height, 0)
+            self.clear_to_eol()
+            Editor.screen = False
+            self.undo = []
+            self.branches = {}
+            self.unindex()
+            if type(self.content) is PagedLines:
+                self.content.close()
+            return key
+        elif key == KEY_NEXT:
+            return key
+        elif key == KEY_GET:
+            if self.mark is not None:
+                self.mark = None
+                self.display_window()
+            return key
+        else:
+            return self.handle_edit_keys(key, char)
+    def edit_loop(self):
+        key = self.edit_start()
+        while key is None:
+            self.display_window(Editor.frame_time and self.frame_pending())
+            if self.wait_input(Editor.idle_time):
+                key = self.edit_key(*self.get_input())
+            else:
+                key = self.idle()
+        return key
+    async def aedit_loop(self, reader, asyncio):
+        key = self.edit_start()
+        while key is None:
             self.display_window()
-            key, char = self.get_input()
-            self.message = ''
-            if key == KEY_QUIT:
-                if self.hash != self.hash_buffer():
-                    res = self.line_edit("File changed! Quit (y/N)? ", "N")
-                    if not res or res[0].upper() != 'Y':
-                        continue
-                self.scroll_region(0)
-                self.mouse_reporting(False)
-                self.goto(Editor.height, 0)
-                self.clear_to_eol()
-                self.undo = []
-                return key
-            elif key == KEY_NEXT:
-                return key
-            elif key == KEY_GET:
-                if self.mark is not None:
-                    self.mark = None
-                    self.display_window()
-                return key
+            if not Editor.inbuf:
+                try:
+                    data = await asyncio.wait_for(reader.read(1 if is_micropython else 4096), Editor.idle_time / 1000)
+                except asyncio.TimeoutError:
+                    key = self.idle()
+                    continue
+                if not data:
+                    raise EOFError("end of input")
+                if is_linux:
+                    Editor.inbuf, Editor.inpos = Editor.inbuf[Editor.inpos:] + (data.encode() if type(data) is str else data), 0
+                else:
+                    Editor.inbuf += data.decode() if type(data) is bytes else data
+            key = self.edit_key(*self.get_input())
+        return key
+    def save_file(self, fname):
+        if Editor.undo_log and self.undo_pos is None:
+            self.undo_pos = self.undo_probe(self.fname + ".pyeundo", None)
+        self.put_file(fname)
+        if Editor.undo_log:
+            self.undo_save(fname)
+        self.fname = fname
+        self.hash = self.hash_buffer()
+        self.changed = ''
+        self.tail, self.follow = None, False
+    def check_file(self):
+        if self.follow:
+            self.follow_poll()
+        if self.tail is not None:
+            return ''
+        try:
+            st = os.stat(self.fname)
+        except:
+            return ''
+        if self.fstat is None or (st[8], st[6]) == self.fstat:
+            return ''
+        res = self.line_edit("File changed on disk! Reload, Diff or Keep (r/d/K)? ", "")
+        res = res[:1].upper() if res else 'K'
+        if res == 'R':
+            lines, size = self.total_lines, self.fstat[1]
+            self.unindex(type(self.content) is PagedLines)
+            if not (st[6] > size and self.hash == self.hash_buffer() and self.get_tail(size)):
+                content = self.content
+                self.get_file(self.fname)
+                if type(content) is PagedLines:
+                    content.close()
+                    self.touch(0)
+                    self.undo_drop(len(self.undo))
+                    self.redo = []
+                else:
+                    self.undo_add(0, content, KEY_NONE, len(self.content))
+            elif self.total_lines > lines:
+                self.undo_add(lines, None, KEY_NONE, lines - self.total_lines)
+            self.total_lines = len(self.content)
+            self.hash = self.hash_buffer()
+            self.changed = ''
+        elif res == 'K':
+            if type(self.content) is PagedLines:
+                clean = self.hash == self.hash_buffer()
+                if not self.content.detach():
+                    self.message = "Lines paged out were overwritten on disk, reload the file"
+                    return res
+                if clean:
+                    self.hash = self.hash_buffer()
+            self.fstat = (st[8], st[6])
+            self.fend = None
+        return res
+    def get_tail(self, pos):
+        if self.fend is None or (pos > 0 and self.fend[-1:] != b"\n"):
+            return False
+        with open(self.fname, "rb") as f:
+            f.seek(pos - len(self.fend))
+            if f.read(len(self.fend)) != self.fend:
+                return False
+            data = f.read()
+        lines = str(data, "utf-8", "ignore").split("\n")
+        if lines[-1] == "":
+            del lines[-1]
+        if pos == 0:
+            self.content = []
+        for l in lines:
+            self.content.append(expandtabs(l.rstrip('\r\t '))[0])
+        self.total_lines = len(self.content)
+        self.fstat = (os.stat(self.fname)[8], pos + len(data))
+        self.fend = self.file_end(self.fname)
+        return True
+    def file_end(self, fname):
+        size = self.fstat[1]
+        with open(fname, "rb") as f:
+            f.seek(max(size - 128, 0))
+            return f.read(min(size, 128))
+    def diff_file(self):
+        disk = Editor(self.tab_size, 0)
+        disk.get_file(self.fname)
+        a, b = self.content, disk.content
+        head = tail = 0
+        while head < min(len(a), len(b)) and a[head] == b[head]:
+            head += 1
+        while tail < min(len(a), len(b)) - head and a[-1 - tail] == b[-1 - tail]:
+            tail += 1
+        return (["Buffer '{}' (-) and the file on disk (+) from line {}".format(self.fname, head + 1)] +
+            ["- " + l for l in a[head:len(a) - tail]] + ["+ " + l for l in b[head:len(b) - tail]])
+    def follow_start(self):
+        self.unindex()
+        with open(self.fname, "rb") as f:
+            end = pos = f.seek(0, 2)
+            while pos > 0:
+                pos = max(pos - 4096, 0)
+                f.seek(pos)
+                i = f.read(end - pos).rfind(b"\n")
+                if i >= 0:
+                    end = pos + i + 1
+                    break
             else:
-                self.handle_edit_keys(key, char)
+                end = 0
+            lines = []
+            for l, _ in lines_back(f, end):
+                lines.append(expandtabs(str(l, "utf-8", "ignore").rstrip('\r\t '))[0])
+                if len(lines) >= Editor.follow_lines:
+                    break
+        lines.reverse()
+        self.content = lines or [""]
+        self.total_lines = len(self.content)
+        self.cur_line, self.col, self.mark = self.total_lines - 1, 0, None
+        self.row = min(self.total_lines, getattr(Editor, "height", self.total_lines)) - 1
+        self.undo_drop(len(self.undo))
+        self.redo = []
+        self.hash = self.hash_buffer()
+        self.changed = ''
+        self.tail, self.follow = end, True
+    def follow_poll(self):
+        size = os.stat(self.fname)[6]
+        if size < self.tail or size - self.tail > 0x10000:
+            self.follow_start()
+            return
+        with open(self.fname, "rb") as f:
+            f.seek(self.tail)
+            data = f.read(size - self.tail)
+        i = data.rfind(b"\n")
+        if i < 0:
+            return
+        self.tail += i + 1
+        clean = self.hash == self.hash_buffer()
+        at_end = self.cur_line >= self.total_lines - 1
+        self.touch(len(self.content))
+        for l in str(data[:i], "utf-8", "ignore").split("\n"):
+            self.content.append(expandtabs(l.rstrip('\r\t '))[0])
+        ni = len(self.content) - Editor.follow_lines
+        if ni > 0:
+            self.touch(0)
+            del self.content[:ni]
+            self.cur_line = max(self.cur_line - ni, 0)
+            self.top_line = max(self.top_line - ni, 0)
+            self.mark = None
+            self.undo_drop(len(self.undo))
+            self.redo = []
+        self.total_lines = len(self.content)
+        if at_end:
+            self.cur_line = self.total_lines - 1
+            ni = self.cur_line - self.top_line - self.height + 1
+            if ni > 0:
+                if ni < self.height:
+                    self.scroll_down(ni)
+                self.top_line += ni
+        if clean:
+            self.hash = self.hash_buffer()
     def packtabs(self, s):
         sb = StringIO()
         for i in range(0, len(s), 8):
@@ -929,47 +1799,90 @@ class Editor:
                 sb.write(c)
         return sb.getvalue()
     def hash_buffer(self):
+        if type(self.content) is PagedLines:
+            return self.content.hash()
         res = 0
         for line in self.content:
             res = ((res * 17 + 1) ^ hash(line)) & 0x3fffffff
         return res
+    def crc_buffer(self):
+        from binascii import crc32
+        res = 0
+        for line in self.content:
+            res = crc32(line.encode("utf-8") + b"\n", res)
+        return res
     def get_file(self, fname):
         if fname:
             try:
                 self.fname = fname
-                if fname in ('.', '..') or (os.stat(fname)[0] & 0x4000):
+                st = os.stat(fname) if fname not in ('.', '..') else (0x4000,)
+                if st[0] & 0x4000:
                     os.chdir(fname)
                     self.work_dir = os.getcwd()
                     self.fname = "/" if self.work_dir == "/" else self.work_dir.split("/")[-1]
                     self.content = ["Directory '{}'".format(self.work_dir), ""] + sorted(os.listdir('.'))
+                elif Editor.ram_budget:
+                    self.content = PagedLines(fname, Editor.ram_budget)
+                    self.write_tabs = "y" if self.content.tabs else "n"
+                    self.fstat = (st[8], st[6])
+                    self.fend = self.file_end(fname)
                 else:
                     if is_micropython:
                         with open(fname) as f:
-                            self.content = f.readlines()
+                            self.content = self.read_lines(f)
                     else:
                         with open(fname, errors="ignore") as f:
-                            self.content = f.readlines()
-                    tabs = False
-                    for i, l in enumerate(self.content):
-                        self.content[i], tf = expandtabs(l.rstrip('\r\n\t '))
-                        tabs |= tf
-                    self.write_tabs = "y" if tabs else "n"
+                            self.content = self.read_lines(f)
+                    if type(self.content) is not PackedLines:
+                        tabs = False
+                        for i, l in enumerate(self.content):
+                            self.content[i], tf = expandtabs(l.rstrip('\r\n\t '))
+                            tabs |= tf
+                        self.write_tabs = "y" if tabs else "n"
+                    self.fstat = (st[8], st[6])
+                    self.fend = self.file_end(fname)
             except OSError:
                 self.message = "Error: file '" + fname + "' may not exist"
         self.hash = self.hash_buffer()
+    def read_lines(self, f):
+        if not Editor.compact:
+            return f.readlines()
+        content, lines, tabs = PackedLines(), [], False
+        for l in f:
+            l, tf = expandtabs(l.rstrip('\r\n\t '))
+            tabs |= tf
+            lines.append(l)
+            if len(lines) >= PackedLines.chunk_lines:
+                content.extend(lines)
+                lines = []
+        content.extend(lines)
+        self.write_tabs = "y" if tabs else "n"
+        return content
     def put_file(self, fname):
         tmpfile = fname + ".pyetmp"
-        with open(tmpfile, "w") as f:
-            for l in self.content:
-                if self.write_tabs == 'y':
-                    f.write(self.packtabs(l) + '\n')
-                else:
-                    f.write(l + '\n')
+        if type(self.content) is PagedLines:
+            with open(tmpfile, "wb") as f:
+                locs = self.content.write(f, self.packtabs if self.write_tabs == 'y' else None)
+            if self.content.lost:
+                os.remove(tmpfile)
+                raise OSError("Lines paged out were overwritten on disk")
+        else:
+            with open(tmpfile, "w") as f:
+                for l in self.content:
+                    if self.write_tabs == 'y':
+                        f.write(self.packtabs(l) + '\n')
+                    else:
+                        f.write(l + '\n')
         try:
             os.remove(fname)
         except:
             pass
         os.rename(tmpfile, fname)
+        if type(self.content) is PagedLines:
+            self.content.rebase(fname, locs)
+        st = os.stat(fname)
+        self.fstat = (st[8], st[6])
+        self.fend = self.file_end(fname)
 def expandtabs(s):
     if '\t' in s:
         sb = StringIO()
@@ -984,20 +1897,529 @@ def expandtabs(s):
         return sb.getvalue(), True
     else:
         return s, False
-def pye(*content, tab_size=4, undo=50, device=0):
+from array import array
+zero_width = array("I", [0x0300, 0x036f, 0x0483, 0x0489, 0x0591, 0x05bd, 0x05bf, 0x05bf,
+    0x05c1, 0x05c2, 0x05c4, 0x05c5, 0x05c7, 0x05c7, 0x0610, 0x061a, 0x064b, 0x065f, 0x0670, 0x0670,
+    0x06d6, 0x06dc, 0x06df, 0x06e4, 0x06e7, 0x06e8, 0x06ea, 0x06ed, 0x0711, 0x0711, 0x0730, 0x074a,
+    0x07a6, 0x07b0, 0x0816, 0x082d, 0x0900, 0x0902, 0x093a, 0x093a, 0x093c, 0x093c, 0x0941, 0x0948,
+    0x094d, 0x094d, 0x0951, 0x0957, 0x0962, 0x0963, 0x0e31, 0x0e31, 0x0e34, 0x0e3a, 0x0e47, 0x0e4e,
+    0x1ab0, 0x1aff, 0x1dc0, 0x1dff, 0x200b, 0x200f, 0x202a, 0x202e, 0x2060, 0x2064, 0x20d0, 0x20f0,
+    0x302a, 0x302d, 0x3099, 0x309a, 0xfe00, 0xfe0f, 0xfe20, 0xfe2f, 0xfeff, 0xfeff, 0x1f3fb, 0x1f3ff,
+    0xe0100, 0xe01ef])
+wide_width = array("I", [0x1100, 0x115f, 0x231a, 0x231b, 0x2329, 0x232a, 0x23e9, 0x23ec,
+    0x23f0, 0x23f0, 0x23f3, 0x23f3, 0x25fd, 0x25fe, 0x2614, 0x2615, 0x2648, 0x2653, 0x267f, 0x267f,
+    0x2693, 0x2693, 0x26a1, 0x26a1, 0x26aa, 0x26ab, 0x26bd, 0x26be, 0x26c4, 0x26c5, 0x26ce, 0x26ce,
+    0x26d4, 0x26d4, 0x26ea, 0x26ea, 0x26f2, 0x26f3, 0x26f5, 0x26f5, 0x26fa, 0x26fa, 0x26fd, 0x26fd,
+    0x2705, 0x2705, 0x270a, 0x270b, 0x2728, 0x2728, 0x274c, 0x274c, 0x274e, 0x274e, 0x2753, 0x2755,
+    0x2757, 0x2757, 0x2795, 0x2797, 0x27b0, 0x27b0, 0x27bf, 0x27bf, 0x2b1b, 0x2b1c, 0x2b50, 0x2b50,
+    0x2b55, 0x2b55, 0x2e80, 0x303e, 0x3041, 0x33ff, 0x3400, 0x4dbf, 0x4e00, 0x9fff, 0xa000, 0xa4cf,
+    0xa960, 0xa97f, 0xac00, 0xd7a3, 0xf900, 0xfaff, 0xfe10, 0xfe19, 0xfe30, 0xfe6f, 0xff00, 0xff60,
+    0xffe0, 0xffe6, 0x16fe0, 0x16fe4, 0x17000, 0x18aff, 0x1b000, 0x1b2ff, 0x1f004, 0x1f004,
+    0x1f0cf, 0x1f0cf, 0x1f18e, 0x1f18e, 0x1f191, 0x1f19a, 0x1f200, 0x1f202, 0x1f210, 0x1f23b,
+    0x1f240, 0x1f248, 0x1f250, 0x1f251, 0x1f260, 0x1f265, 0x1f300, 0x1f64f, 0x1f680, 0x1f6ff,
+    0x1f7e0, 0x1f7eb, 0x1f90c, 0x1f9ff, 0x1fa70, 0x1faff, 0x20000, 0x2fffd, 0x30000, 0x3fffd])
+col_cache = {}
+try:
+    isascii = str.isascii
+except AttributeError:
+    isascii = None
+def in_ranges(ranges, o):
+    lo, hi = 0, len(ranges) >> 1
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if ranges[2 * mid + 1] < o:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo < len(ranges) >> 1 and ranges[2 * lo] <= o
+def char_width(c):
+    o = ord(c)
+    if o < 0x300:
+        return 1
+    return 0 if in_ranges(zero_width, o) else 2 if in_ranges(wide_width, o) else 1
+def line_cols(l):
+    if isascii and isascii(l):
+        return None
+    cols = col_cache.get(l, col_cache)
+    if cols is col_cache:
+        if len(col_cache) >= 256:
+            col_cache.clear()
+        cols = None
+        if len(l) != len(bytes(l, "utf-8")):
+            cols, col = array("I", [0]), 0
+            for c in l:
+                col += char_width(c)
+                cols.append(col)
+        col_cache[l] = cols
+    return cols
+def col_of(l, i):
+    cols = line_cols(l)
+    if cols is None:
+        return i
+    return cols[i] if i <= len(l) else cols[-1] + i - len(l)
+def index_of(l, col, end=False):
+    cols = line_cols(l)
+    if cols is None:
+        return col
+    if col > cols[-1]:
+        return len(l) + col - cols[-1]
+    lo, hi = 0, len(l)
+    while lo < hi:
+        if end:
+            mid = (lo + hi + 1) >> 1
+            if cols[mid] <= col:
+                lo = mid
+            else:
+                hi = mid - 1
+        else:
+            mid = (lo + hi) >> 1
+            if cols[mid] >= col:
+                hi = mid
+            else:
+                lo = mid + 1
+    return lo
+def lines_back(f, pos):
+    buf, start = b"", pos
+    while pos > 0:
+        i = buf.rfind(b"\n", 0, len(buf) - 1)
+        if i < 0 and start > 0:
+            n = min(start, 512)
+            start -= n
+            f.seek(start)
+            buf = f.read(n) + buf
+        else:
+            yield buf[i + 1:-1], start + i + 1
+            buf = buf[:i + 1]
+            pos = start + i + 1
+class LineIndex:
+    def __init__(self):
+        self.data = []
+        self.content, self.first, self.tail = None, 0, 0
+    def compute(self, l):
+        return None
+    def changed(self, first, old, new, delta):
+        pass
+    def leave(self, content, start, end):
+        pass
+    def touch(self, content, line, end):
+        if content is not self.content:
+            return
+        n = len(content)
+        start = min(self.first, n)
+        stop = max(n - self.tail, start)
+        self.first = min(self.first, line)
+        self.tail = min(self.tail, 0 if end is None else max(n - end, 0))
+        new_stop = max(n - self.tail, self.first)
+        self.leave(content, self.first, min(start, new_stop))
+        self.leave(content, max(stop, self.first), new_stop)
+    def update(self, content):
+        if content is not self.content:
+            if self.content is not None:
+                self.touch(self.content, 0, None)
+            self.content, self.first, self.tail = content, 0, 0
+        n = len(content)
+        first = min(self.first, n, len(self.data))
+        delta = n - len(self.data)
+        end = max(n - self.tail, first, first + delta)
+        self.first = self.tail = 1 << 30
+        if end == first and delta == 0:
+            return
+        old = self.data[first:end - delta]
+        new = [self.compute(l) for l in content[first:end]]
+        self.data[first:end - delta] = new
+        self.changed(first, old, new, delta)
+class Wrap(LineIndex):
+    single = (0,)
+    def __init__(self, width):
+        from array import array
+        LineIndex.__init__(self)
+        self.width = width
+        self.points = self.data
+        self.tree = array("i", [0])
+        self.built = 0
+        self.top = self.start = 0
+        self.shown = None
+    def compute(self, l):
+        cols = col_of(l, len(l))
+        if cols < self.width:
+            return Wrap.single
+        points, start = [0], 0
+        while cols - col_of(l, start) >= self.width:
+            stop = index_of(l, col_of(l, start) + self.width, True)
+            end = l.rfind(" ", start, stop) + 1
+            start = end if end > start else stop
+            points.append(start)
+        return tuple(points)
+    def changed(self, first, old, new, delta):
+        if delta:
+            self.built = min(self.built, first)
+        else:
+            for i in range(len(new)):
+                if len(new[i]) != len(old[i]):
+                    self.add(first + i, len(new[i]) - len(old[i]))
+    def build(self, n):
+        first, n = self.built, min(n, len(self.points))
+        if n <= first:
+            return
+        tree = self.tree[:first + 1]
+        tree.extend([len(p) for p in self.points[first:n]])
+        i = first
+        while i > 0:
+            if i + (i & -i) <= n:
+                tree[i + (i & -i)] += tree[i]
+            i -= i & -i
+        for i in range(first + 1, n + 1):
+            if i + (i & -i) <= n:
+                tree[i + (i & -i)] += tree[i]
+        self.tree, self.built = tree, n
+    def add(self, i, n):
+        i += 1
+        while i <= self.built:
+            self.tree[i] += n
+            i += i & -i
+    def rows(self, i):
+        self.build(i)
+        n = 0
+        while i > 0:
+            n += self.tree[i]
+            i -= i & -i
+        return n
+    def find(self, row):
+        while self.built < len(self.points) and self.rows(self.built) <= row:
+            self.build(min(self.built * 2 + 64, len(self.points)))
+        tree, n = self.tree, self.built
+        i, step = 0, 1
+        while step * 2 <= n:
+            step *= 2
+        while step:
+            if i + step <= n and tree[i + step] <= row:
+                i += step
+                row -= tree[i]
+            step >>= 1
+        if i >= n:
+            return n - 1, len(self.points[n - 1]) - 1
+        return i, row
+    def sub(self, line, col):
+        points = self.points[line]
+        i = len(points) - 1
+        while points[i] > col:
+            i -= 1
+        return i
+class Outline(LineIndex):
+    def compute(self, l):
+        s = l.lstrip()
+        for kind in ("def ", "class ", "async def "):
+            if s.startswith(kind):
+                name = s[len(kind):].split("(")[0].split(":")[0].strip()
+                return l[:len(l) - len(s)] + kind + name if name else None
+        if l[:1].isalpha() or l[:1] == "_":
+            i = l.find("=")
+            name = l[:i].split(":")[0].strip()
+            if i > 0 and l[i + 1:i + 2] != "=" and all(c.isalpha() or c.isdigit() or c == "_" for c in name):
+                return name
+        return None
+    def symbols(self):
+        return [(label, i) for i, label in enumerate(self.data) if label is not None]
+class Words(LineIndex):
+    split = None
+    epoch = 0
+    def __init__(self):
+        LineIndex.__init__(self)
+        self.epoch = Words.epoch
+    def update(self, content):
+        if self.epoch != Words.epoch:
+            self.epoch, self.content, self.data = Words.epoch, None, []
+        LineIndex.update(self, content)
+    def words(self, l):
+        if Words.split is None:
+            Words.split = re_compile(("[^a-zA-Z0-9" if is_micropython else "[^\\w") +
+                "".join("\\" + c for c in Editor.word_char) + "]+").split
+        return [w for w in Words.split(l) if len(w) > 2]
+    def compute(self, l):
+        count, words = Editor.word_count, Editor.word_list
+        for w in self.words(l):
+            if w in count:
+                count[w] += 1
+            else:
+                count[w] = 1
+                words.insert(lower_bound(words, w), w)
+        return None
+    def leave(self, content, start, end):
+        count, words = Editor.word_count, Editor.word_list
+        for l in content[start:end]:
+            for w in self.words(l):
+                if w not in count:
+                    continue
+                count[w] -= 1
+                if count[w] == 0:
+                    del count[w]
+                    del words[lower_bound(words, w)]
+def lower_bound(a, x):
+    lo, hi = 0, len(a)
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if a[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+class PackedLines:
+    chunk_lines = 32
+    def __init__(self, lines=()):
+        from array import array
+        self.chunks = []
+        self.start = array("i", [0])
+        self.cache = (None, None)
+        self.extend(lines)
+    def __len__(self):
+        return self.start[-1]
+    def __iter__(self):
+        for c in range(len(self.chunks)):
+            yield from self.lines(c)
+    def find(self, i):
+        lo, hi = 0, len(self.chunks) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) >> 1
+            if self.start[mid] <= i:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    def lines(self, c):
+        if self.cache[0] != c:
+            self.cache = (c, str(self.chunks[c], "utf-8").split("\n"))
+        return self.cache[1]
+    def span(self, i):
+        n = len(self)
+        if type(i) is slice:
+            start = 0 if i.start is None else i.start + n if i.start < 0 else i.start
+            stop = n if i.stop is None else i.stop + n if i.stop < 0 else i.stop
+            return min(max(start, 0), n), min(max(stop, 0), n)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("line index out of range")
+        return i, i + 1
+    def __getitem__(self, i):
+        start, stop = self.span(i)
+        if type(i) is not slice:
+            c = self.find(start)
+            return self.lines(c)[start - self.start[c]]
+        res = []
+        while start < stop:
+            c = self.find(start)
+            res += self.lines(c)[start - self.start[c]:stop - self.start[c]]
+            start = self.start[c + 1]
+        return res
+    def __setitem__(self, i, lines):
+        start, stop = self.span(i)
+        self.replace(start, max(start, stop), lines if type(i) is slice else [lines])
+    def __delitem__(self, i):
+        start, stop = self.span(i)
+        self.replace(start, max(start, stop), [])
+    def __iadd__(self, lines):
+        self.extend(lines)
+        return self
+    def append(self, line):
+        self.replace(len(self), len(self), [line])
+    def extend(self, lines):
+        self.replace(len(self), len(self), list(lines))
+    def insert(self, i, line):
+        i = self.span(slice(i, i))[0]
+        self.replace(i, i, [line])
+    def pop(self, i=-1):
+        line = self[i]
+        del self[i]
+        return line
+    def replace(self, i, j, lines):
+        from array import array
+        n, cl = len(self), PackedLines.chunk_lines
+        if i == j == n and (not self.chunks or self.start[-1] - self.start[-2] >= cl):
+            c0 = c1 = len(self.chunks)
+        else:
+            c0 = self.find(min(i, n - 1))
+            c1 = (self.find(j - 1) if j > i else c0) + 1
+        base = self.start[c0]
+        old = []
+        for c in range(c0, c1):
+            old += self.lines(c)
+        old[i - base:j - base] = lines
+        self.cache = (None, None)
+        self.chunks[c0:c1] = ["\n".join(old[k:k + cl]).encode("utf-8") for k in range(0, len(old), cl)]
+        start = array("i", self.start[:c0 + 1])
+        for k in range(0, len(old), cl):
+            start.append(start[-1] + min(cl, len(old) - k))
+        delta = len(lines) - (j - i)
+        for c in range(c1 + 1, len(self.start)):
+            start.append(self.start[c] + delta)
+        self.start = start
+        return c0, c1, divmod(len(old) + cl - 1, cl)[0]
+    def info(self):
+        return "{} Bytes in {} chunks".format(sum(len(c) for c in self.chunks if c), len(self.chunks))
+class PagedLines(PackedLines):
+    def __init__(self, fname, budget):
+        from binascii import crc32
+        self.fname, self.budget = fname, budget
+        self.where, self.used = [], []
+        self.loaded = []
+        self.tick = self.swap = self.live = 0
+        self.tabs = self.lost = False
+        PackedLines.__init__(self)
+        cl = PackedLines.chunk_lines
+        self.f = open(fname, "rb")
+        pos, raw = 0, []
+        while True:
+            l = self.f.readline()
+            if l:
+                raw.append(l)
+            if raw and (len(raw) >= cl or not l):
+                data = b"".join(raw)
+                n = len(data) - (data[-1:] == b"\n")
+                lines = self.decode(data[:n])
+                self.chunks.append("\n".join(lines).encode("utf-8"))
+                self.start.append(self.start[-1] + len(lines))
+                self.where.append((0, pos, n, crc32(data[:n])))
+                self.used.append(0)
+                self.loaded.append(len(self.chunks) - 1)
+                self.evict(-1)
+                pos += len(data)
+                raw = []
+            if not l:
+                break
+    def scratch(self):
+        return self.fname + ".pyeswap.pyetmp"
+    def decode(self, data):
+        lines = str(data, "utf-8", "ignore").split("\n")
+        for i, l in enumerate(lines):
+            lines[i], tf = expandtabs(l.rstrip('\r\t '))
+            self.tabs |= tf
+        return lines
+    def page_in(self, c):
+        if self.chunks[c] is None:
+            from binascii import crc32
+            w = self.where[c]
+            if w[0]:
+                with open(self.scratch(), "rb") as f:
+                    f.seek(w[1])
+                    self.chunks[c] = f.read(w[2])
+            else:
+                self.f.seek(w[1])
+                data = self.f.read(w[2])
+                self.lost |= crc32(data) != w[3]
+                self.chunks[c] = "\n".join(self.decode(data)).encode("utf-8")
+            self.loaded.append(c)
+        self.tick += 1
+        self.used[c] = self.tick
+        self.evict(c)
+    def lines(self, c):
+        if self.cache[0] == c:
+            return self.cache[1]
+        self.page_in(c)
+        return PackedLines.lines(self, c)
+    def put(self, data):
+        if self.swap - self.live > max(self.live, self.budget):
+            self.compact()
+        with open(self.scratch(), "ab" if self.swap else "wb") as f:
+            f.write(data)
+        self.swap += len(data)
+        self.live += len(data)
+        return (1, self.swap - len(data), len(data))
+    def compact(self):
+        tmp = self.fname + ".pyeswap2.pyetmp"
+        pos = 0
+        with open(self.scratch(), "rb") as f, open(tmp, "wb") as g:
+            for c, w in enumerate(self.where):
+                if w is not None and w[0]:
+                    f.seek(w[1])
+                    g.write(f.read(w[2]))
+                    self.where[c] = (1, pos, w[2])
+                    pos += w[2]
+        os.remove(self.scratch())
+        os.rename(tmp, self.scratch())
+        self.swap = self.live = pos
+    def evict(self, keep):
+        size = sum(len(self.chunks[i]) for i in self.loaded)
+        while size > self.budget:
+            c, t = -1, self.tick + 1
+            for i in self.loaded:
+                if self.used[i] < t and i != keep:
+                    c, t = i, self.used[i]
+            if c < 0:
+                return
+            if self.where[c] is None:
+                self.where[c] = self.put(self.chunks[c])
+            size -= len(self.chunks[c])
+            self.chunks[c] = None
+            self.loaded.remove(c)
+    def replace(self, i, j, lines):
+        c0, c1, nc = PackedLines.replace(self, i, j, lines)
+        shift = nc - (c1 - c0)
+        self.loaded = [c if c < c0 else c + shift for c in self.loaded if not c0 <= c < c1] + list(range(c0, c0 + nc))
+        self.tick += 1
+        for w in self.where[c0:c1]:
+            if w is not None and w[0]:
+                self.live -= w[2]
+        self.where[c0:c1] = [None] * nc
+        self.used[c0:c1] = [self.tick] * nc
+        self.evict(-1)
+        return c0, c1, nc
+    def detach(self):
+        for c in range(len(self.chunks)):
+            if self.where[c] is not None and not self.where[c][0]:
+                self.page_in(c)
+                self.where[c] = self.put(self.chunks[c])
+        return not self.lost
+    def hash(self):
+        res = 0
+        for c in range(len(self.chunks)):
+            res = ((res * 17 + 1) ^ hash(self.where[c] or self.chunks[c])) & 0x3fffffff
+        return res
+    def write(self, f, pack):
+        from binascii import crc32
+        locs, pos = [], 0
+        for c in range(len(self.chunks)):
+            data = b"".join([(pack(l) if pack else l).encode("utf-8") + b"\n" for l in self.lines(c)])
+            f.write(data)
+            locs.append((0, pos, len(data) - 1, crc32(data[:-1])))
+            pos += len(data)
+        return locs
+    def rebase(self, fname, locs):
+        self.close()
+        self.fname, self.where, self.lost = fname, locs, False
+        self.f = open(fname, "rb")
+    def close(self):
+        self.f.close()
+        if self.swap:
+            try:
+                os.remove(self.scratch())
+            except OSError:
+                pass
+            self.swap = self.live = 0
+    def info(self):
+        return "{} Bytes in {} of {} chunks in memory".format(sum(len(c) for c in self.chunks if c),
+            len(self.chunks) - self.chunks.count(None), len(self.chunks))
+def pye_open(content, tab_size, undo, undo_log, follow, view, compact, ram_budget, profile, trace, fps, slot_budget, wrap, numbers, complete):
     gc.collect()
+    Editor.undo_log = undo_log
+    Editor.compact = compact
+    Editor.ram_budget = ram_budget
+    Editor.frame_time = int(1000 / fps) if fps else 0
+    Editor.resized, Editor.screen = True, False
+    Editor.slot_budget = slot_budget
+    Editor.wrap = wrap
+    Editor.numbers = numbers
+    Editor.complete, Editor.word_count, Editor.word_list = complete, {}, []
+    Words.epoch += 1
     index = 0
     undo = max(4, (undo if type(undo) is int else 0))
     current_dir = os.getcwd()
     if content:
         slot = []
         for f in content:
-            slot.append(Editor(tab_size, undo))
+            kind = Editor
+            slot.append(kind(tab_size, undo))
             if type(f) == str and f:
-                try:
-                    slot[index].get_file(f)
-                except Exception as err:
-                    slot[index].message = "{!r}".format(err)
+                slot[index].fname, slot[index].follow, slot[index].lazy = f, follow, True
             else:
                 try:
                     slot[index].content = [str(_) for _ in f]
@@ -1007,26 +2429,135 @@ def pye(*content, tab_size=4, undo=50, device=0):
     else:
         slot = [Editor(tab_size, undo)]
         slot[0].get_file(current_dir)
+    return slot, current_dir
+def pye_switch(slot, index, key):
+    if key == KEY_QUIT:
+        if len(slot) == 1:
+            return None
+        del slot[index]
+    elif key == KEY_GET:
+        f = slot[index].line_edit("Open file: ", "", "_.-")
+        if f is not None:
+            slot.append(Editor(slot[index].tab_size, slot[index].undo_limit))
+            index = len(slot) - 1
+            slot[index].get_file(f)
+    elif key == KEY_NEXT:
+        index += 1
+        if Editor.slot_budget:
+            pye_unload(slot, index % len(slot))
+    elif key in (KEY_DIFF, KEY_MEMINFO):
+        slot.append(Editor(slot[index].tab_size, slot[index].undo_limit))
+        slot[-1].content = slot[index].diff_file() if key == KEY_DIFF else mem_info(slot[:-1])
+        slot[-1].hash = slot[-1].hash_buffer()
+        index = len(slot) - 1
+    return index
+def pye_unload(slot, keep):
+    loaded = [ed for ed in slot if ed is not slot[keep] and not ed.lazy and ed.fstat is not None and
+        ed.tail is None and type(ed.content) is list and not ed.undo and not ed.redo]
+    size = sum(ed.fstat[1] for ed in slot if not ed.lazy and ed.fstat is not None)
+    loaded.sort(key=lambda ed: ed.activated)
+    for ed in loaded:
+        if size <= Editor.slot_budget:
+            break
+        if ed.hash == ed.hash_buffer():
+            size -= ed.fstat[1]
+            ed.unload()
+def mem_size(o):
+    if hasattr(sys, "getsizeof"):
+        size = sys.getsizeof(o)
+    elif type(o) in (str, bytes):
+        size = len(o) + 16
+    else:
+        size = 16 + 4 * len(o) if type(o) in (list, tuple, dict) else 0
+    if type(o) is dict:
+        o = list(o.values())
+    if type(o) in (list, tuple):
+        size += sum(mem_size(i) for i in o)
+    return size
+def mem_info(slot):
+    res = ["Memory report" + PYE_VERSION, ""]
+    for i, ed in enumerate(slot):
+        if ed.lazy:
+            content = "not loaded"
+        elif isinstance(ed.content, PackedLines):
+            content = ed.content.info()
+        elif type(ed.content) is list:
+            content = "{} Bytes".format(mem_size(ed.content))
+        else:
+            content = "not in memory"
+        res += ["Window {} '{}': {} lines, {}".format(i + 1, ed.fname, len(ed.content), content),
+            "    undo {} records {} Bytes, redo {} records {} Bytes, branches {} Bytes".format(
+            len(ed.undo), mem_size(ed.undo), len(ed.redo), mem_size(ed.redo), mem_size(ed.branches))]
+    res += ["", "Yank buffer: {} lines {} Bytes".format(len(Editor.yank_buffer), mem_size(Editor.yank_buffer)),
+        "Screen buffer: {} rows {} Bytes".format(len(Editor.scrbuf), mem_size(Editor.scrbuf)),
+        "Word index: {} words {} Bytes".format(len(Editor.word_list), mem_size(Editor.word_count) + mem_size(Editor.word_list)), ""]
+    if is_micropython:
+        before = (gc.mem_alloc(), gc.mem_free())
+        gc.collect()
+        res.append("gc: {} Bytes allocated, {} free; after collect {} allocated, {} free".format(
+            before[0], before[1], gc.mem_alloc(), gc.mem_free()))
+    return res
+def pye_close(slot, current_dir):
+    Editor.deinit_tty()
+    Editor.yank_buffer = []
+    os.chdir(current_dir)
+    return slot[0].content if (slot[0].fname == "") else slot[0].fname
+def pye(*content, tab_size=4, undo=50, device=0, undo_log=False, follow=False, view=False, compact=False, ram_budget=0, profile=0, trace=None, fps=0, slot_budget=0, wrap=False, numbers=0, complete=False):
+    slot, current_dir = pye_open(content, tab_size, undo, undo_log, follow, view, compact, ram_budget, profile, trace, fps, slot_budget, wrap, numbers, complete)
     Editor.init_tty(device)
-    while True:
+    pye_edit(slot)
+    return pye_close(slot, current_dir)
+def pye_edit(slot):
+    index = 0
+    while index is not None:
         try:
             index %= len(slot)
-            key = slot[index].edit_loop()
-            if key == KEY_QUIT:
-                if len(slot) == 1:
-                    break
-                del slot[index]
-            elif key == KEY_GET:
-                f = slot[index].line_edit("Open file: ", "", "_.-")
-                if f is not None:
-                    slot.append(Editor(tab_size, undo))
-                    index = len(slot) - 1
-                    slot[index].get_file(f)
-            elif key == KEY_NEXT:
-                index += 1
+            index = pye_switch(slot, index, slot[index].edit_loop())
+        except EOFError:
+            break
         except Exception as err:
             slot[index].message = "{!r}".format(err)
-    Editor.deinit_tty()
-    Editor.yank_buffer = []
-    os.chdir(current_dir)
-    return slot[0].content if (slot[0].fname == "") else slot[0].fname
+async def apye(*content, tab_size=4, undo=50, device=0, undo_log=False, follow=False, view=False, compact=False, ram_budget=0, profile=0, trace=None, fps=0, slot_budget=0, wrap=False, numbers=0, complete=False, reader=None, autosave=0):
+    try:
+        import uasyncio as asyncio
+    except ImportError:
+        import asyncio
+    slot, current_dir = pye_open(content, tab_size, undo, undo_log, follow, view, compact, ram_budget, profile, trace, fps, slot_budget, wrap, numbers, complete)
+    Editor.init_tty(device)
+    if reader is None:
+        reader = asyncio.StreamReader(sys.stdin)
+    saver = asyncio.create_task(pye_autosave(slot, autosave, asyncio)) if autosave else None
+    index = 0
+    while index is not None:
+        try:
+            index %= len(slot)
+            index = pye_switch(slot, index, await slot[index].aedit_loop(reader, asyncio))
+        except EOFError:
+            break
+        except Exception as err:
+            slot[index].message = "{!r}".format(err)
+    if saver:
+        saver.cancel()
+    return pye_close(slot, current_dir)
+async def pye_autosave(slot, interval, asyncio, lock=None):
+    while True:
+        await asyncio.sleep(interval)
+        if lock and not lock.acquire(False):
+            continue
+        try:
+            for ed in slot:
+                if ed.fstat is not None and ed.tail is None and ed.hash != ed.hash_buffer():
+                    try:
+                        st = os.stat(ed.fname)
+                    except OSError:
+                        st = None
+                    if st is not None and (st[8], st[6]) != ed.fstat:
+                        ed.message = "File changed on disk, not saved"
+                        continue
+                    try:
+                        ed.save_file(ed.fname)
+                    except Exception as err:
+                        ed.message = "{!r}".format(err)
+        finally:
+            if lock:
+                lock.release()